@@ -11,10 +11,17 @@ import sys
 import subprocess
 import csv
 import getpass
+import hashlib
+import threading
+import time
+import concurrent.futures
+from collections import OrderedDict, deque
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog, filedialog
+from contextlib import contextmanager
 import psycopg2
-from psycopg2 import sql
+from psycopg2 import sql, pool
+from psycopg2.extras import execute_values
 from datetime import datetime
 
 # -------------------------
@@ -30,112 +37,346 @@ DB_CONFIG = {
 }
 
 PAGE_SIZE = 20  # строк на страницу
+CARS_PAGE_SIZE = 500  # строк на страницу в "Cars on parking"
+TREE_FEED_BATCH = 100  # строк за один проход Tk при порционном заполнении дерева
+
+# размеры пула соединений
+POOL_MIN_CONN = 2
+POOL_MAX_CONN = 8
+
+DB_WORKERS = 2     # потоков для запросов к БД вне Tk main loop
+DB_POLL_MS = 30    # период опроса завершения фоновой задачи
+
+QUERY_CACHE_TTL = 5.0  # сек: сколько живёт результат в cached_fetch
+SPECIAL_QUERY_CACHE_SIZE = 32  # сколько результатов спецзапросов держать в памяти
+
+EXPORT_BUFFER = 1 << 23  # буфер файла при экспорте (8 MiB): меньше мелких write()
+
+BACKUP_JOBS = 4         # параллельных заданий pg_dump для формата "каталог"
+BACKUP_GZIP_LEVEL = 6   # уровень сжатия текстового дампа .sql.gz
+BACKUP_POLL_MS = 200    # период опроса процесса pg_dump
+BACKUP_LOG_TAIL = 50    # сколько последних строк лога pg_dump хранить для сообщения об ошибке
 
 # -------------------------
 # Вспомогательные функции DB
 # -------------------------
+class PreparingConnection(psycopg2.extensions.connection):
+    """Соединение, которое помнит имена операторов, подготовленных (PREPARE) в его сессии."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+POOL = None  # psycopg2.pool.ThreadedConnectionPool, создаётся при первом обращении
+
+def get_pool():
+    global POOL
+    if POOL is None:
+        POOL = pool.ThreadedConnectionPool(POOL_MIN_CONN, POOL_MAX_CONN,
+                                           connection_factory=PreparingConnection, **DB_CONFIG)
+    return POOL
+
+def close_pool():
+    global POOL
+    if POOL is not None:
+        POOL.closeall()
+        POOL = None
+
+@contextmanager
 def get_conn():
+    """Берёт соединение из пула и возвращает его обратно после использования.
+    При ошибке подключения отдаёт None (как и раньше)."""
     try:
-        return psycopg2.connect(**DB_CONFIG)
+        p = get_pool()
+        conn = p.getconn()
     except Exception as e:
-        messagebox.showerror("DB Error", f"Не удалось подключиться к БД: {e}")
-        return None
+        # Tk не потокобезопасен: диалог показываем только из главного потока,
+        # фоновые задачи получат ошибку "Нет соединения" через возвращаемое значение
+        if threading.current_thread() is threading.main_thread():
+            messagebox.showerror("DB Error", f"Не удалось подключиться к БД: {e}")
+        yield None
+        return
+    try:
+        yield conn
+    finally:
+        # битое соединение закрываем, чтобы пул не раздал его повторно
+        p.putconn(conn, close=bool(conn.closed))
 
 def fetch_all(query, params=None):
-    conn = get_conn()
-    if not conn:
-        return None, "Нет соединения"
-    try:
-        cur = conn.cursor()
-        cur.execute(query, params or ())
-        cols = [d[0] for d in cur.description] if cur.description else []
-        rows = cur.fetchall()
-        cur.close()
-        conn.close()
-        return (cols, rows), None
-    except Exception as e:
+    with get_conn() as conn:
+        if not conn:
+            return None, "Нет соединения"
         try:
-            conn.close()
-        except:
-            pass
-        return None, str(e)
-
-def execute(query, params=None):
-    conn = get_conn()
-    if not conn:
-        return "Нет соединения"
-    try:
-        cur = conn.cursor()
-        cur.execute(query, params or ())
-        conn.commit()
-        cur.close()
-        conn.close()
+            with conn.cursor() as cur:
+                cur.execute(query, params or ())
+                cols = [d[0] for d in cur.description] if cur.description else []
+                rows = cur.fetchall()
+            return (cols, rows), None
+        except Exception as e:
+            try:
+                conn.rollback()
+            except:
+                pass
+            return None, str(e)
+
+def copy_query_to(f, query, params=None):
+    """Выгружает результат запроса в бинарный файл f через COPY (...) TO STDOUT.
+    Формат тот же, что у экспорта TXT: CSV с табуляцией и строкой заголовков,
+    NULL — пустая строка, кодировка UTF-8 независимо от кодировки клиента;
+    строки форматирует сервер, Python только перекладывает байты."""
+    with get_conn() as conn:
+        if not conn:
+            raise RuntimeError("Нет соединения")
+        try:
+            with conn.cursor() as cur:
+                # COPY не принимает параметры — подставляем их на клиенте
+                select = cur.mogrify(query, params or None)
+                select = select.decode(psycopg2.extensions.encodings[conn.encoding])
+                q = "COPY ({}) TO STDOUT WITH (FORMAT csv, HEADER, DELIMITER E'\\t', NULL '', ENCODING 'UTF8')".format(
+                    select.strip().rstrip(";"))
+                cur.copy_expert(q, f)
+            conn.commit()
+        except Exception:
+            try:
+                conn.rollback()
+            except:
+                pass
+            raise
+
+def bulk_insert(table, cols, rows, ignore_conflicts=False, cur=None):
+    """Вставляет много строк одним INSERT ... VALUES (...), (...) через execute_values.
+    ignore_conflicts=True добавляет ON CONFLICT DO NOTHING.
+    cur — курсор уже открытой транзакции: вставка идёт в ней, без своего соединения
+    и commit, а исключение пробрасывается вызывающему.
+    Возвращает ошибку (str) или None."""
+    q = sql.SQL("INSERT INTO {t} ({cols}) VALUES %s{conflict}").format(
+        t=sql.Identifier(table),
+        cols=sql.SQL(", ").join(map(sql.Identifier, cols)),
+        conflict=sql.SQL(" ON CONFLICT DO NOTHING" if ignore_conflicts else ""))
+    if cur is not None:
+        execute_values(cur, q, rows)
         return None
-    except Exception as e:
+    with get_conn() as conn:
+        if not conn:
+            return "Нет соединения"
+        try:
+            with conn.cursor() as cur:
+                execute_values(cur, q, rows)
+            conn.commit()
+            return None
+        except Exception as e:
+            try:
+                # Откат изменений в случае ошибки
+                conn.rollback()
+            except:
+                pass
+            return str(e)
+
+def numbered_params(n, start=1):
+    """sql-список плейсхолдеров $start, ..., $(start+n-1) для PREPARE."""
+    return sql.SQL(", ").join(sql.SQL(f"${i}") for i in range(start, start + n))
+
+def _run_prepared(conn, cur, prefix, stmt, params):
+    """PREPARE stmt в сессии conn (один раз) и EXECUTE с params на cur.
+    Имя оператора — prefix + хэш текста, поэтому разные тексты не конфликтуют."""
+    text = stmt.as_string(conn)
+    name = f"{prefix}_{hashlib.md5(text.encode()).hexdigest()[:12]}"
+    if name not in conn.prepared:
+        cur.execute(sql.SQL("PREPARE {} AS ").format(sql.Identifier(name)) + stmt)
+        conn.prepared.add(name)
+    q = sql.SQL("EXECUTE {}").format(sql.Identifier(name))
+    if params:
+        # EXECUTE name () без аргументов — синтаксическая ошибка
+        q += sql.SQL(" ({})").format(sql.SQL(", ").join(sql.Placeholder() * len(params)))
+    cur.execute(q, params or ())
+
+def execute_prepared(prefix, stmt, params):
+    """Выполняет stmt (sql.Composable с плейсхолдерами $1..$n) через PREPARE/EXECUTE.
+    PREPARE делается один раз на соединение пула, дальше сервер пропускает разбор
+    и планирование. Возвращает ошибку (str) или None."""
+    with get_conn() as conn:
+        if not conn:
+            return "Нет соединения"
         try:
-            # Откат изменений в случае ошибки
-            conn.rollback() 
-            conn.close()
-        except:
-            pass
-        return str(e)
+            with conn.cursor() as cur:
+                _run_prepared(conn, cur, prefix, stmt, params)
+            conn.commit()
+            return None
+        except Exception as e:
+            try:
+                # Откат изменений в случае ошибки
+                conn.rollback()
+            except:
+                pass
+            return str(e)
+
+def fetch_prepared(prefix, stmt, params=None):
+    """fetch_all для часто повторяемых SELECT: stmt с $1..$n выполняется через PREPARE/EXECUTE,
+    так что план запроса строится один раз на соединение пула. Возвращает ((cols, rows), err)."""
+    with get_conn() as conn:
+        if not conn:
+            return None, "Нет соединения"
+        try:
+            with conn.cursor() as cur:
+                _run_prepared(conn, cur, prefix, stmt, params)
+                cols = [d[0] for d in cur.description] if cur.description else []
+                rows = cur.fetchall()
+            return (cols, rows), None
+        except Exception as e:
+            try:
+                conn.rollback()
+            except:
+                pass
+            return None, str(e)
 
 # -------------------------
 # Users table helper (authorization)
 # -------------------------
 # [Оставлено без изменений]
 
+# учетки по умолчанию: (login, pass, role)
+DEFAULT_USERS = [
+    ("admin", "admin", "admin"),
+    ("user", "user", "user"),
+]
+
 def ensure_users_table():
     """Если таблицы users нет — создаём и вставляем примеры."""
-    q = """SELECT EXISTS (
-        SELECT 1 FROM information_schema.tables 
-        WHERE table_schema='public' AND table_name='users'
-    );"""
+    # идемпотентно: CREATE ... IF NOT EXISTS; учетки по умолчанию добавляются
+    # только в пустую таблицу — удалённые администратором admin/user не возвращаются
+    q = """
+    CREATE TABLE IF NOT EXISTS users(
+        login varchar PRIMARY KEY,
+        pass varchar NOT NULL,
+        role varchar NOT NULL check (role in ('admin','user'))
+    );
+    """
+    # таблица и учетки — одна транзакция на одном соединении:
+    # сбой посередине не оставит пустую таблицу users
+    with get_conn() as conn:
+        if not conn:
+            return False, "Нет соединения"
+        try:
+            with conn.cursor() as cur:
+                cur.execute(q)
+                cur.execute("SELECT EXISTS (SELECT 1 FROM users)")
+                if not cur.fetchone()[0]:
+                    bulk_insert("users", ["login", "pass", "role"], DEFAULT_USERS, ignore_conflicts=True, cur=cur)
+            conn.commit()
+            return True, None
+        except Exception as e:
+            try:
+                conn.rollback()
+            except:
+                pass
+            return False, str(e)
+
+def ensure_filter_indexes(stop=None):
+    """Создаёт trigram GIN-индексы (pg_trgm) по текстовым колонкам таблиц public,
+    чтобы фильтр `col::text ILIKE '%val%'` шёл по индексу, а не полным сканированием.
+    char(n) не индексируем: его приведение к text — функция, индекс по колонке
+    фильтру не подошёл бы, а gin_trgm_ops для bpchar нет.
+    Идемпотентно (IF NOT EXISTS). Каждый оператор выполняется отдельно в autocommit:
+    CONCURRENTLY не блокирует запись в таблицы, а ошибка на одной таблице
+    (например, чужой владелец) не отменяет остальные индексы.
+    stop — threading.Event: если установлен, следующие операторы не запускаются.
+    Возвращает (None, ошибки через "; " или None) — для run_db."""
+    q = """SELECT table_name, column_name FROM information_schema.columns
+        WHERE table_schema='public' AND table_name <> 'users'
+          AND data_type IN ('text', 'character varying')
+        ORDER BY table_name, ordinal_position;"""
     res, err = fetch_all(q)
     if err:
-        return False, err
-    exists = res[1][0][0]
-    if not exists:
-        # создаём таблицу и вставим две учетки: admin/admin и user/user
-        qcreate = """
-        CREATE TABLE users(
-            login varchar PRIMARY KEY,
-            pass varchar NOT NULL,
-            role varchar NOT NULL check (role in ('admin','user'))
-        );
-        """
-        e = execute(qcreate)
-        if e:
-            return False, e
-        e = execute("INSERT INTO users(login, pass, role) VALUES (%s,%s,%s)", ("admin","admin","admin"))
-        if e:
-            return False, e
-        e = execute("INSERT INTO users(login, pass, role) VALUES (%s,%s,%s)", ("user","user","user"))
-        if e:
-            # если вставка не удалась, это не критично
-            pass
-    return True, None
+        return None, err
+    # прерванный CREATE INDEX CONCURRENTLY оставляет невалидный индекс, который
+    # IF NOT EXISTS потом пропускает — такие удаляем и строим заново
+    # (%% в шаблоне LIKE равносилен %, а в тексте для psycopg2 безопасен)
+    q_invalid = """SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+        WHERE NOT i.indisvalid AND c.relnamespace = 'public'::regnamespace
+          AND c.relname LIKE 'idx\\_%%\\_trgm';"""
+    res_invalid, err = fetch_all(q_invalid)
+    if err:
+        return None, err
+    stmts = [sql.SQL("DROP INDEX CONCURRENTLY IF EXISTS {}").format(sql.Identifier(idx))
+             for idx, in res_invalid[1]]
+    for t, c in res[1]:
+        stmts.append(sql.SQL("CREATE INDEX CONCURRENTLY IF NOT EXISTS {idx} ON {t} USING GIN ({c} gin_trgm_ops)").format(
+            idx=sql.Identifier(f"idx_{t}_{c}_trgm"), t=sql.Identifier(t), c=sql.Identifier(c)))
+    errors = []
+    with get_conn() as conn:
+        if not conn:
+            return None, "Нет соединения"
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                try:
+                    cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+                except Exception as e:
+                    # без расширения ни один индекс не создать
+                    return None, str(e).strip()
+                for st in stmts:
+                    if stop is not None and stop.is_set():
+                        break  # приложение закрывается
+                    try:
+                        cur.execute(st)
+                    except Exception as e:
+                        errors.append(str(e).strip())
+        finally:
+            try:
+                conn.autocommit = False
+            except:
+                pass
+    return None, "; ".join(errors) or None
+
+def fetch_schema(table=None):
+    """Колонки и первичные ключи таблиц схемы public (или одной таблицы table).
+    Возвращает ({table: (cols, pk_cols)}, err), pk_cols — кортеж колонок PRIMARY KEY
+    в порядке ключа (пустой, если PK у таблицы нет)."""
+    qcols = "SELECT table_name, column_name FROM information_schema.columns WHERE table_schema='public'"
+    # PK берём прямо из pg_catalog: это заметно дешевле представлений information_schema
+    qpk = """SELECT cl.relname, a.attname
+        FROM pg_constraint c
+        JOIN pg_class cl ON cl.oid = c.conrelid
+        JOIN pg_attribute a ON a.attrelid = c.conrelid AND a.attnum = ANY(c.conkey)
+        WHERE c.contype = 'p' AND c.connamespace = 'public'::regnamespace"""
+    params = ()
+    if table:
+        qcols += " AND table_name=%s"
+        qpk += " AND cl.relname=%s"
+        params = (table,)
+    qcols += " ORDER BY table_name, ordinal_position;"
+    qpk += " ORDER BY cl.relname, array_position(c.conkey, a.attnum);"
+    res, err = fetch_all(qcols, params)
+    if err:
+        return None, err
+    res_pk, err = fetch_all(qpk, params)
+    if err:
+        return None, err
+    cols = {}
+    for t, c in res[1]:
+        cols.setdefault(t, []).append(c)
+    pks = {}
+    for t, c in res_pk[1]:
+        pks.setdefault(t, []).append(c)
+    return {t: (cs, tuple(pks.get(t, ()))) for t, cs in cols.items()}, None
 
 def check_credentials(login, password):
     # возвращает роль или None
-    conn = get_conn()
-    if not conn:
-        return None, "Нет соединения"
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT role FROM users WHERE login=%s AND pass=%s", (login, password))
-        r = cur.fetchone()
-        cur.close()
-        conn.close()
-        if not r:
-            return None, None
-        return r[0], None
-    except Exception as e:
+    with get_conn() as conn:
+        if not conn:
+            return None, "Нет соединения"
         try:
-            conn.close()
-        except:
-            pass
-        return None, str(e)
+            with conn.cursor() as cur:
+                cur.execute("SELECT role FROM users WHERE login=%s AND pass=%s", (login, password))
+                r = cur.fetchone()
+            if not r:
+                return None, None
+            return r[0], None
+        except Exception as e:
+            try:
+                conn.rollback()
+            except:
+                pass
+            return None, str(e)
 
 # -------------------------
 # GUI: Login dialog
@@ -174,32 +415,64 @@ class ParkingApp:
         self.user = None
         self.role = None
         self.last_query_result = None  # tuple (cols, rows)
+        self.last_query_sql = None  # tuple (query, params), из которого получен last_query_result
         self.current_table = None
         self.page = 0
+        # курсоры keyset-пагинации: [i] — значения PK последней строки перед страницей i
+        # (None для первой страницы и для таблиц без PK, которые листаются через OFFSET)
+        self._page_cursor_stack = [None]
         self.page_size = PAGE_SIZE
         self.total_rows = 0
         self.filter_col = None
         self.filter_val = None
+        # постраничный спецпросмотр (Cars on parking): {"page", "size"}; None — режим таблицы
+        self._paging = None
+        # кэш метаданных: table -> (cols, pk_cols); схема в течение сессии не меняется
+        self._schema_cache = {}
+        # кэш count(*): (table, filter_col, filter_val) -> total
+        self._count_cache = {}
+        # LRU-кэш спецзапросов: (choice, params) -> (cols, rows)
+        self._sq_cache = OrderedDict()
+        # кэш с TTL для фиксированных запросов: (query, params) -> (time.monotonic(), (cols, rows))
+        self._query_cache = {}
+        # фоновые запросы к БД; результат возвращается в Tk через root.after
+        self._db_executor = concurrent.futures.ThreadPoolExecutor(max_workers=DB_WORKERS)
+        self._load_seq = 0  # номер последней загрузки страницы, устаревшие ответы отбрасываются
+        self._running = set()  # длительные операции в процессе (save/backup) — от повторного запуска
+        self._stop = threading.Event()  # выход из приложения: фоновым задачам пора остановиться
+        self._filter_dlg = None  # (Toplevel, Combobox, Entry): диалог фильтра строится один раз и прячется
 
         # --- СЛОВАРЬ ДЛЯ РУЧНЫХ PK ---
-        self.manual_pk_tables = {
+        self.manual_pk_tables = frozenset({
             #"employee", "parking_event", "parking_place", 
             "car", "driver", 
             "car_on_parking", "event_car", "event_empl"
-        }
+        })
 
         ok, err = ensure_users_table()
         if not ok:
             messagebox.showwarning("Users table", f"Не удалось обеспечить таблицу users: {err}")
+        # ensure_users_table мог выполнить DDL — сбрасываем кэш метаданных
+        self._schema_cache.clear()
 
         if not self.login():
             root.destroy()
             return
+        self.load_schema()
 
         self.build_menu()
         self.build_ui()
         self.bind_keys()
+        self.root.protocol("WM_DELETE_WINDOW", self.close_app)
         self.show_table("parking_place")  # стартовая таблица
+        # индексы для фильтра строим в фоне: при первом запуске это может быть долго,
+        # а без них фильтр просто работает медленнее, поэтому ошибки только в строке статуса
+        self.run_background(ensure_filter_indexes, self._filter_indexes_done, self._stop)
+
+    def _filter_indexes_done(self, result):
+        _, err = result
+        if err:
+            self.status_label.config(text=f"Индексы для фильтра созданы не все: {err}")
 
     # -------------------------
     # Login flow (unchanged)
@@ -239,6 +512,8 @@ class ParkingApp:
         tables_menu.add_command(label="Parking_place (F2)", underline=0, accelerator="F2", command=lambda: self.show_table("parking_place"))
         tables_menu.add_command(label="Cars on parking (F3)", underline=0, accelerator="F3", command=self.cmd_show_cars_on_parking)
         tables_menu.add_command(label="Parking_event (F4)", underline=0, accelerator="F4", command=lambda: self.show_table("parking_event"))
+        tables_menu.add_separator()
+        tables_menu.add_command(label="Refresh schema", underline=0, command=self.refresh_schema)
         menubar.add_cascade(label="Tables", menu=tables_menu, underline=1)  # Alt+T
 
         ops_menu = tk.Menu(menubar, tearoff=False)
@@ -320,6 +595,7 @@ class ParkingApp:
         self.tree = None
         self.vscroll = None
         self.hscroll = None
+        self._tree_cols_sig = None  # колонки, с которыми построен текущий Treeview
 
         # Bind arrow keys for paging
         self.root.bind("<Left>", lambda e: self.prev_page())
@@ -351,7 +627,9 @@ class ParkingApp:
     # -------------------------
     def show_table(self, table_name):
         self.current_table = table_name
+        self._paging = None
         self.page = 0
+        self._page_cursor_stack = [None]
         self.filter_col = None
         self.filter_val = None
         self.reload_page()
@@ -359,40 +637,192 @@ class ParkingApp:
     def reload_page(self):
         if not self.current_table:
             return
-        # count total
-        # fetch_all expects string, so let's do simple:
-        res, err = fetch_all(f"SELECT count(*) FROM {self.current_table}")
-        if err:
-            self.status_label.config(text=f"Ошибка: {err}")
-            return
-        total = res[1][0][0] if res and res[1] else 0
-        self.total_rows = total
-        total_pages = max(1, (total + self.page_size -1)//self.page_size)
-        if self.page >= total_pages:
-            self.page = total_pages -1
-        offset = self.page * self.page_size
-        q = f"SELECT * FROM {self.current_table}"
+        table_cols, pk_cols = self.get_table_meta(self.current_table)
+        if not table_cols:
+            return
+        # запросы собираются через psycopg2.sql: идентификаторы экранируются,
+        # а текст запроса одинаков для всех страниц (меняются только параметры)
+        tbl = sql.Identifier(self.current_table)
+        # keyset идёт по всему PK: по неуникальной колонке строки с одинаковым
+        # значением на границе страниц пропадали бы; без PK — обычный OFFSET
+        pk_idx = [table_cols.index(c) for c in pk_cols]
+        if pk_cols:
+            order = sql.SQL(", ").join(map(sql.Identifier, pk_cols))
+            seek = sql.SQL("({}) > ({})").format(order, sql.SQL(", ").join(sql.Placeholder() * len(pk_cols)))
+        else:
+            # как в прежнем OFFSET-варианте — по первой колонке
+            order = sql.Identifier(table_cols[0])
+        conds = []
         params = []
         if self.filter_col and self.filter_val is not None:
-            q += f" WHERE {sql.Identifier(self.filter_col).string} ILIKE %s"
+            # ::text — в диалоге фильтра доступны все колонки, а ILIKE для integer/date
+            # не определён; для text/varchar приведение пустое и trigram-индекс работает
+            conds.append(sql.SQL("{}::text ILIKE %s").format(sql.Identifier(self.filter_col)))
             params.append(f"%{self.filter_val}%")
-        q += f" ORDER BY 1 LIMIT {self.page_size} OFFSET {offset};"
-        # Note: to keep it simple, we form q as string with identifiers assumed safe (table/column names)
-        # but we ensure filter_col from UI is one of table columns
-        res, err = fetch_all(q, params)
-        if err:
-            self.status_label.config(text="Ошибка: " + err)
-            return
-        cols, rows = res
-        self.last_query_result = (cols, rows)
-        self.build_tree(cols)
-        self.fill_tree(rows)
-        self.update_page_label()
+        # count total — кэшируется до ближайшего изменения данных (add/delete/update)
+        key = (self.current_table, self.filter_col, self.filter_val)
+        cached_total = self._count_cache.get(key)
+        count_q = sql.SQL("SELECT count(*) FROM {tbl}{where}").format(tbl=tbl, where=self._where(conds))
+        page_size = self.page_size
+        page = self.page
+        stack = list(self._page_cursor_stack)
+
+        def _do_fetch():
+            # выполняется в рабочем потоке: только БД и локальные данные, без Tk
+            with get_conn() as conn:
+                if not conn:
+                    return None, "Нет соединения"
+                try:
+                    # count и страница — в одной транзакции на одном соединении:
+                    # один BEGIN/COMMIT, а REPEATABLE READ даёт обоим запросам общий
+                    # снимок данных, т.е. число строк согласовано со страницей
+                    conn.set_session(isolation_level="REPEATABLE READ", readonly=True)
+                    with conn.cursor() as cur:
+                        total = cached_total
+                        if total is None:
+                            cur.execute(count_q, params)
+                            total = cur.fetchone()[0]
+                        total_pages = max(1, (total + page_size -1)//page_size)
+                        # keyset-пагинация: страница начинается после последнего PK предыдущей страницы,
+                        # поэтому стоимость запроса не растёт с номером страницы (в отличие от OFFSET)
+                        pg = min(page, total_pages - 1, len(stack) - 1)
+                        page_conds = list(conds)
+                        page_params = list(params)
+                        if pk_cols and stack[pg] is not None:
+                            page_conds.append(seek)
+                            page_params.extend(stack[pg])
+                        q = sql.SQL("SELECT * FROM {tbl}{where} ORDER BY {order} LIMIT %s").format(
+                            tbl=tbl, where=self._where(page_conds), order=order)
+                        page_params.append(page_size)
+                        if not pk_cols:
+                            q += sql.SQL(" OFFSET %s")
+                            page_params.append(pg * page_size)
+                        # SELECT * отдаёт колонки таблицы в порядке ordinal_position — они уже
+                        # есть в кэше схемы, поэтому из cursor.description их не собираем
+                        cur.execute(q, page_params)
+                        rows = cur.fetchall()
+                    conn.commit()
+                    return (total, pg, rows, q, page_params), None
+                except Exception as e:
+                    try:
+                        conn.rollback()
+                    except:
+                        pass
+                    return None, str(e)
+                finally:
+                    try:
+                        conn.set_session(isolation_level="DEFAULT", readonly="DEFAULT")
+                    except:
+                        pass
+
+        self._load_seq += 1
+        seq = self._load_seq
+        self.status_label.config(text="Loading…")
+
+        def _apply(result):
+            if seq != self._load_seq:
+                return  # пока грузили, пользователь ушёл на другую страницу/таблицу
+            data, err = result
+            if err:
+                self.status_label.config(text="Ошибка: " + err)
+                return
+            total, pg, rows, q, page_params = data
+            cols = table_cols
+            self._count_cache[key] = total
+            self.total_rows = total
+            self.page = pg
+            # курсор следующей страницы — PK последней строки текущей
+            # (для OFFSET-режима курсор не нужен, запись лишь отмечает, что страница есть)
+            del self._page_cursor_stack[pg + 1:]
+            if rows:
+                self._page_cursor_stack.append(tuple(rows[-1][i] for i in pk_idx) if pk_cols else None)
+            self.last_query_result = (cols, rows)
+            self.last_query_sql = (q, page_params)
+            # при листании колонки те же — пересоздавать Treeview не нужно
+            if tuple(cols) != self._tree_cols_sig:
+                self.build_tree(cols)
+            self.fill_tree(rows)
+            self.update_page_label()
+
+        self.run_db(_do_fetch, _apply)
+
+    def run_db(self, fn, on_done, *args):
+        """Выполняет fn(*args) в пуле потоков БД, затем on_done(результат) в потоке Tk.
+        fn возвращает пару (результат, ошибка); если fn выбросит исключение,
+        on_done всё равно вызывается — с (None, текст ошибки)."""
+        fut = self._db_executor.submit(fn, *args)
+        self._wait_future(fut, on_done)
+
+    def run_background(self, fn, on_done, *args):
+        """Как run_db, но в отдельном daemon-потоке: для долгих служебных задач,
+        которые не должны занимать пул запросов UI и задерживать выход из программы."""
+        fut = concurrent.futures.Future()
+
+        def _run():
+            try:
+                fut.set_result(fn(*args))
+            except Exception as e:
+                fut.set_exception(e)
+
+        threading.Thread(target=_run, daemon=True).start()
+        self._wait_future(fut, on_done)
+
+    def _wait_future(self, fut, on_done):
+        if fut.done():
+            try:
+                result = fut.result()
+            except Exception as e:
+                # иначе on_done не вызовется и флаг задачи (_running) останется до конца сессии
+                result = (None, str(e))
+            on_done(result)
+        else:
+            self.root.after(DB_POLL_MS, self._wait_future, fut, on_done)
+
+    def cached_fetch(self, q, params=None, ttl=QUERY_CACHE_TTL, prepared=None):
+        """fetch_all с кэшем результата на ttl секунд (можно вызывать из рабочего потока).
+        prepared=(prefix, stmt) — тот же запрос в виде с $1..$n, выполняется через fetch_prepared.
+        Кэш сбрасывается invalidate_caches() после любых изменений данных."""
+        key = (q, tuple(params) if params else None)
+        hit = self._query_cache.get(key)
+        if hit and time.monotonic() - hit[0] < ttl:
+            return hit[1], None
+        res, err = fetch_prepared(*prepared, params) if prepared else fetch_all(q, params)
+        if not err:
+            self._query_cache[key] = (time.monotonic(), res)
+        return res, err
+
+    def _start_task(self, name):
+        """Помечает операцию name как выполняющуюся; False — если она уже идёт.
+        Операции вызываются и из меню, и горячими клавишами, и кнопками, поэтому
+        защищаемся флагом, а не отключением отдельной кнопки."""
+        if name in self._running:
+            self.status_label.config(text=f"{name}: уже выполняется…")
+            return False
+        self._running.add(name)
+        return True
+
+    def _finish_task(self, name):
+        self._running.discard(name)
+
+    @staticmethod
+    def _where(conds):
+        """Склеивает список sql-условий в ' WHERE a AND b' (или пустой SQL)."""
+        if not conds:
+            return sql.SQL("")
+        return sql.SQL(" WHERE ") + sql.SQL(" AND ").join(conds)
+
+    @staticmethod
+    def _pk_cond(pk_cols, start=1):
+        """sql-условие 'a = $start AND b = $(start+1) ...' по всем колонкам ключа (для PREPARE)."""
+        return sql.SQL(" AND ").join(
+            sql.SQL("{} = ${}").format(sql.Identifier(c), sql.SQL(str(i)))
+            for i, c in enumerate(pk_cols, start))
 
     def build_tree(self, columns):
         # clear tree frame
         for w in self.tree_frame.winfo_children():
             w.destroy()
+        self._tree_cols_sig = tuple(columns)
         self.vscroll = ttk.Scrollbar(self.tree_frame, orient="vertical")
         self.hscroll = ttk.Scrollbar(self.tree_frame, orient="horizontal")
         self.tree = ttk.Treeview(self.tree_frame, columns=columns, show="headings", yscrollcommand=self.vscroll.set, xscrollcommand=self.hscroll.set)
@@ -407,26 +837,57 @@ class ParkingApp:
             self.tree.column(c, width=140, anchor="w")
 
     def fill_tree(self, rows):
-        # clear
-        for r in self.tree.get_children():
-            self.tree.delete(r)
-        for row in rows:
-            safe_row = tuple("" if v is None else v for v in row)
-            self.tree.insert("", "end", values=safe_row)
-        self.status_label.config(text=f"Showing {len(rows)} rows (total {self.total_rows})")
+        # clear — одним вызовом вместо удаления по одной строке
+        self.tree.delete(*self.tree.get_children())
+        self._insert_rows(rows)
+        self._show_row_count(len(rows))
+
+    def _insert_rows(self, rows, start=0):
+        """Добавляет rows в конец дерева; start — номер первой строки (для iid)."""
+        # None показываем пустой строкой; явные iid избавляют Tk от генерации собственных идентификаторов
+        for i, row in enumerate(rows, start):
+            self.tree.insert("", "end", iid=str(i), values=tuple("" if v is None else v for v in row))
+
+    def _show_row_count(self, n):
+        self.status_label.config(text=f"Showing {n} rows (total {self.total_rows})")
+
+    def _feed_rows(self, rows, seq, start=0):
+        """Порционно вставляет rows в дерево, между порциями отдавая управление Tk:
+        первые строки видны сразу, окно не замирает на большой странице."""
+        if seq != self._load_seq:
+            return  # пользователь уже ушёл на другую страницу/таблицу
+        end = start + TREE_FEED_BATCH
+        self._insert_rows(rows[start:end], start)
+        if end < len(rows):
+            # не after(0): цепочка таймеров с нулевой задержкой выполняется целиком раньше
+            # idle-обработчиков, а перерисовка Treeview — idle-обработчик, и окно не обновлялось бы
+            self.root.after(1, self._feed_rows, rows, seq, end)
+            return
+        self._show_row_count(len(rows))
 
     def update_page_label(self):
-        total_pages = max(1, (self.total_rows + self.page_size -1)//self.page_size)
+        size = self._paging["size"] if self._paging else self.page_size
+        total_pages = max(1, (self.total_rows + size -1)//size)
         self.page_label.config(text=f"Page {self.page+1}/{total_pages}")
 
     def prev_page(self):
+        if self._paging:
+            if self._paging["page"] > 0:
+                self.cmd_show_cars_on_parking(self._paging["page"] - 1, self._paging["size"])
+            return
         if self.page > 0:
             self.page -= 1
             self.reload_page()
 
     def next_page(self):
+        if self._paging:
+            size = self._paging["size"]
+            total_pages = max(1, (self.total_rows + size -1)//size)
+            if self._paging["page"] < total_pages -1:
+                self.cmd_show_cars_on_parking(self._paging["page"] + 1, size)
+            return
         total_pages = max(1, (self.total_rows + self.page_size -1)//self.page_size)
-        if self.page < total_pages -1:
+        if self.page < total_pages -1 and self.page + 1 < len(self._page_cursor_stack):
             self.page += 1
             self.reload_page()
 
@@ -435,8 +896,18 @@ class ParkingApp:
     # -------------------------
     def cmd_view(self):
         # re-run current view (Ctrl+V)
+        self.invalidate_caches()
+        if self._paging:
+            self.cmd_show_cars_on_parking(self._paging["page"], self._paging["size"])
+            return
         self.reload_page()
 
+    def invalidate_caches(self):
+        """Сбрасывает кэши результатов запросов после изменения данных."""
+        self._count_cache.clear()
+        self._sq_cache.clear()
+        self._query_cache.clear()
+
     def cmd_add(self):
         if self.role != "admin":
             messagebox.showwarning("Permission", "Добавление доступно только администратору")
@@ -457,9 +928,9 @@ class ParkingApp:
         is_manual_pk = self.current_table in self.manual_pk_tables
 
         # Пропускаем PK только если он не ручной (т.е. предполагаем SERIAL)
-        skip_cols = []
+        skip_cols = frozenset()
         if pk_col and not is_manual_pk:
-            skip_cols = [pk_col]
+            skip_cols = frozenset([pk_col])
 
         # ### [Конец изменения 1]
 
@@ -475,17 +946,18 @@ class ParkingApp:
         insert_vals = [vals.get(c) for c in insert_cols]
         
         # build insert
-        col_names = ",".join([f'"{c}"' for c in insert_cols])
-        placeholders = ",".join(["%s"]*len(insert_cols))
-        
-        q = f'INSERT INTO "{self.current_table}" ({col_names}) VALUES ({placeholders})'
-        e = execute(q, insert_vals)
+        q = sql.SQL("INSERT INTO {t} ({cols}) VALUES ({vals})").format(
+            t=sql.Identifier(self.current_table),
+            cols=sql.SQL(",").join(map(sql.Identifier, insert_cols)),
+            vals=numbered_params(len(insert_cols)))
+        e = execute_prepared("ins", q, insert_vals)
         
         if e:
             # Теперь, если ошибка, пользователь увидит, что ему нужно вводить PK
             messagebox.showerror("Error", f"Insert failed. Возможно, нужно ввести уникальное значение для PK: {e}")
         else:
             messagebox.showinfo("OK", "Запись добавлена")
+            self.invalidate_caches()
             self.reload_page()
 
     def cmd_delete(self):
@@ -496,18 +968,27 @@ class ParkingApp:
         if not sel:
             messagebox.showinfo("Info", "Выделите строку для удаления")
             return
+        if not self.current_table:
+            messagebox.showinfo("Info", "Выберите таблицу")
+            return
         row = self.tree.item(sel[0])["values"]
         cols = self.last_query_result[0]
-        # assume first column is PK
-        pk_col = cols[0]
-        pk_val = row[0]
-        if messagebox.askyesno("Confirm", f"Удалить запись {pk_val} из {self.current_table}?"):
-            q = f'DELETE FROM "{self.current_table}" WHERE "{pk_col}" = %s'
-            e = execute(q, (pk_val,))
+        # удаляем по всем колонкам настоящего PK: по одной колонке составного ключа
+        # (или по первой колонке таблицы без PK) удалились бы и чужие строки
+        pk_cols = self.get_pk_cols(self.current_table)
+        if not pk_cols or not all(c in cols for c in pk_cols):
+            messagebox.showerror("Error", "Не удалось определить первичный ключ для удаления")
+            return
+        pk_vals = [row[cols.index(c)] for c in pk_cols]
+        if messagebox.askyesno("Confirm", f"Удалить запись {', '.join(map(str, pk_vals))} из {self.current_table}?"):
+            q = sql.SQL("DELETE FROM {t} WHERE {cond}").format(
+                t=sql.Identifier(self.current_table), cond=self._pk_cond(pk_cols))
+            e = execute_prepared("del", q, pk_vals)
             if e:
                 messagebox.showerror("Error", f"Delete failed: {e}")
             else:
                 messagebox.showinfo("OK", "Удалено")
+                self.invalidate_caches()
                 self.reload_page()
 
     def cmd_update(self):
@@ -523,38 +1004,47 @@ class ParkingApp:
         data = {cols[i]: row[i] for i in range(len(cols))}
         
         # ### [ИЗМЕНЕНИЕ 2: Запрет редактирования PK]
-        cols_all, pk_col = self.get_table_columns_and_pk(self.current_table)
+        cols_all, _ = self.get_table_columns_and_pk(self.current_table)
         
         if not cols_all:
              messagebox.showerror("Error", "Не удалось получить колонки для обновления.")
              return
+        # строку находим по всем колонкам PK; без PK однозначно найти её нельзя
+        pk_cols = self.get_pk_cols(self.current_table)
+        if not pk_cols or not all(c in cols for c in pk_cols):
+            messagebox.showerror("Error", "Не удалось определить первичный ключ для обновления")
+            return
         # В режиме Update Primary Key (PK) редактировать нельзя.
         # Это предотвратит неявные ошибки ссылочной целостности.
-        skip_cols = [pk_col] if pk_col in cols_all else []
+        skip_cols = frozenset(pk_cols)
+        # Формируем SET-часть, исключая PK
+        update_cols = [c for c in cols if c not in skip_cols]
+        if not update_cols:
+            messagebox.showinfo("Info", "Все колонки таблицы входят в первичный ключ — изменять нечего")
+            return
         
         newvals = self.open_record_editor(f"Update {self.current_table}", cols, data, skip_cols=skip_cols)
         
         if newvals is None:
             return
             
-        # update by PK = first column (или pk_col, если известен)
-        pk_col_name = pk_col if pk_col else cols[0]
-        pk_val = data[pk_col_name]
+        set_clause = sql.SQL(", ").join(
+            sql.SQL("{} = ${}").format(sql.Identifier(c), sql.SQL(str(i)))
+            for i, c in enumerate(update_cols, 1))
         
-        # Формируем SET-часть, исключая PK
-        update_cols = [c for c in cols if c != pk_col_name]
-        set_clause = ", ".join([f'"{c}" = %s' for c in update_cols])
+        # Параметры: сначала значения обновляемых колонок, потом значения PK
+        params = [newvals[c] for c in update_cols] + [data[c] for c in pk_cols]
         
-        # Параметры: сначала значения обновляемых колонок, потом значение PK
-        params = [newvals[c] for c in update_cols] + [pk_val]
-        
-        q = f'UPDATE "{self.current_table}" SET {set_clause} WHERE "{pk_col_name}" = %s'
-        e = execute(q, params)
+        q = sql.SQL("UPDATE {t} SET {set} WHERE {cond}").format(
+            t=sql.Identifier(self.current_table), set=set_clause,
+            cond=self._pk_cond(pk_cols, len(update_cols) + 1))
+        e = execute_prepared("upd", q, params)
         
         if e:
             messagebox.showerror("Error", f"Update failed: {e}")
         else:
             messagebox.showinfo("OK", "Обновлено")
+            self.invalidate_caches()
             self.reload_page()
 
     def cmd_special_query(self):
@@ -574,27 +1064,13 @@ class ParkingApp:
             WHERE p.floor = %s
             ORDER BY p.p_number;
             """
-            res, err = fetch_all(q, (floor,))
-            if err:
-                messagebox.showerror("Error", err)
-                return
-            cols, rows = res
-            self.last_query_result = (cols, rows)
-            self.build_tree(cols)
-            self.fill_tree(rows)
+            params = (floor,)
         elif choice.strip() == "2":
             date = simpledialog.askstring("Date", "Enter date (YYYY-MM-DD):")
             if not date:
                 return
             q = "SELECT e.id, e.e_date, e.e_time, e.event, ec.car_number FROM Parking_event e LEFT JOIN Event_car ec ON e.id = ec.event_id WHERE e.e_date = %s;"
-            res, err = fetch_all(q, (date,))
-            if err:
-                messagebox.showerror("Error", err)
-                return
-            cols, rows = res
-            self.last_query_result = (cols, rows)
-            self.build_tree(cols)
-            self.fill_tree(rows)
+            params = (date,)
         elif choice.strip() == "3":
             q = """
             SELECT p.floor, count(cop.car_number) as occupied
@@ -602,22 +1078,48 @@ class ParkingApp:
             LEFT JOIN Car_on_parking cop ON p.p_number = cop.parking_number
             GROUP BY p.floor ORDER BY p.floor;
             """
-            res, err = fetch_all(q)
+            params = None
+        else:
+            messagebox.showinfo("Info", "Unknown choice")
+            return
+
+        key = (choice.strip(), params)
+
+        def _apply(result):
+            if seq != self._load_seq:
+                return  # пока выполнялся запрос, пользователь открыл таблицу или другой запрос
+            res, err = result
             if err:
+                self.status_label.config(text="Ошибка: " + err)
                 messagebox.showerror("Error", err)
                 return
             cols, rows = res
+            self._sq_cache[key] = res
+            self._sq_cache.move_to_end(key)
+            if len(self._sq_cache) > SPECIAL_QUERY_CACHE_SIZE:
+                self._sq_cache.popitem(last=False)
             self.last_query_result = (cols, rows)
+            self.last_query_sql = (q, params)
             self.build_tree(cols)
             self.fill_tree(rows)
-        else:
-            messagebox.showinfo("Info", "Unknown choice")
+
+        self._load_seq += 1  # незавершённая загрузка страницы не должна перетереть результат
+        seq = self._load_seq
+        self._paging = None
+        if key in self._sq_cache:
+            # спецзапросы только читают данные — повторный запуск с теми же
+            # параметрами до изменения данных отдаём из кэша без обращения к БД
+            _apply((self._sq_cache[key], None))
+            return
+        self.status_label.config(text="Loading…")
+        self.run_db(fetch_all, _apply, q, params)
 
     # -------------------------
     # Helpers: open record editor dialog
     # -------------------------
-    def open_record_editor(self, title, cols, data, skip_cols=[]): # ### [ИЗМЕНЕНИЕ 3: Добавлен skip_cols]
+    def open_record_editor(self, title, cols, data, skip_cols=frozenset()): # ### [ИЗМЕНЕНИЕ 3: Добавлен skip_cols]
         # data: dict col->value (existing) or {}
+        skip_cols = frozenset(skip_cols)  # проверки `c in skip_cols` идут на каждую колонку
         dlg = tk.Toplevel(self.root)
         dlg.title(title)
         dlg.transient(self.root)
@@ -626,6 +1128,9 @@ class ParkingApp:
         frm = tk.Frame(dlg)
         frm.pack(padx=8, pady=8)
         r = 0
+        # метаданные берём один раз на диалог: и для readonly-полей, и для проверки в on_ok
+        pk_cols = self.get_pk_cols(self.current_table)
+        pk_set = set(pk_cols)
         for c in cols:
             if c in skip_cols: # ### [ИЗМЕНЕНИЕ 4: Пропускаем колонку]
                 continue
@@ -639,7 +1144,7 @@ class ParkingApp:
             e.insert(0, initial_value)
             
             # Если поле - часть ключа, но не пропускается, его нельзя менять
-            if c in self.get_pk_cols(self.current_table) and not skip_cols:
+            if c in pk_set and not skip_cols:
                 e.config(state='readonly')
                 
             entries[c] = e
@@ -650,17 +1155,26 @@ class ParkingApp:
         btnf.pack(pady=6)
         result = {"ok": False, "values": None}
         def on_ok():
-            # Собираем значения только для тех колонок, которые были показаны
-            vals = {}
-            for c in cols:
-                if c in entries:
-                    vals[c] = entries[c].get().strip()
-                elif c in skip_cols and c in data:
-                    # Для пропускаемой колонки (PK при UPDATE) берем старое значение
-                    vals[c] = data[c]
-                else:
-                    # Если поле пропущено, но не было в data (PK при ADD), оставляем None
-                    vals[c] = None
+            # Собираем значения только для тех колонок, которые были показаны;
+            # для пропускаемой колонки (PK при UPDATE) берем старое значение,
+            # а если её не было в data (PK при ADD), оставляем None
+            # *** ИСПРАВЛЕНИЕ 1: Преобразуем пустую строку в None ***
+            # Это предотвратит попытку Postgres преобразовать "" в integer.
+            vals = {c: (entries[c].get().strip() or None) if c in entries
+                       else data[c] if c in skip_cols and c in data
+                       else None
+                    for c in cols}
+
+            # *** ИСПРАВЛЕНИЕ 2: КРИТИЧЕСКАЯ ПРОВЕРКА PK ***
+            # Проверяем, что ID/PK заполнен, если он ручной (manual_pk_tables)
+            if self.current_table in self.manual_pk_tables:
+                # Проверка каждой колонки ключа: значение не None и не пустая строка
+                # (0 из data при UPDATE — допустимый ключ, поэтому не просто "not pk_val")
+                for pk_col in pk_cols:
+                    pk_val = vals.get(pk_col)
+                    if pk_val is None or not str(pk_val).strip():
+                        messagebox.showerror("Validation Error", f"Поле '{pk_col}' должно быть заполнено (это Первичный ключ, не SERIAL).")
+                        return # Остаемся в диалоге
 
             result["ok"] = True
             result["values"] = vals
@@ -703,39 +1217,75 @@ class ParkingApp:
     # -------------------------
     def get_table_columns_and_pk(self, table):
         """
-        Возвращает список всех колонок. Предполагает, что первая колонка - первичный ключ.
+        Возвращает список всех колонок и первичный ключ таблицы.
+        Если у таблицы нет PRIMARY KEY, ключом считается первая колонка;
+        у составного PK — его первая колонка (весь ключ отдаёт get_pk_cols).
         Возвращает: (['col1', 'col2', ...], 'pk_name' или None)
         """
+        cols, pk_cols = self.get_table_meta(table)
+        if not cols:
+            return None, None
+        return cols, (pk_cols[0] if pk_cols else cols[0])
+
+    def get_table_meta(self, table):
+        """
+        Возвращает (колонки, кортеж колонок PRIMARY KEY) или (None, None) при ошибке.
+        Кортеж PK пустой, если первичного ключа у таблицы нет.
+        Результат кэшируется в self._schema_cache (обычно заполняется load_schema при входе).
+        """
         # !!! КРИТИЧНОЕ ИСПРАВЛЕНИЕ: table.lower() для information_schema !!!
-        table_for_schema = table.lower() 
-        
-        q = f"SELECT column_name FROM information_schema.columns WHERE table_schema='public' AND table_name=%s ORDER BY ordinal_position;"
-        res, err = fetch_all(q, (table_for_schema,))
-        
+        table_for_schema = table.lower()
+        if table_for_schema in self._schema_cache:
+            return self._schema_cache[table_for_schema]
+
+        schema, err = fetch_schema(table_for_schema)
+
         if err:
             # Если ошибка - скорее всего, проблема с подключением или правами.
             messagebox.showerror("Metadata Error", f"Ошибка получения метаданных для {table}: {err}")
             return None, None
-            
-        cols = [r[0] for r in res[1]] if res and res[1] else []
-        
-        pk_col = None
-        if cols:
-             # Предполагаем, что первая колонка является первичным ключом
-             pk_col = cols[0]
-             
-        if not cols:
-             # Если cols пуст, значит, не найдена таблица (или нет колонок)
+
+        if table_for_schema not in schema:
+             # Если колонок нет, значит, не найдена таблица
              messagebox.showerror("Error", f"Не удалось найти колонки для таблицы: {table}")
              return None, None
-             
-        return cols, pk_col
 
+        self._schema_cache.update(schema)
+        return schema[table_for_schema]
+
+    def load_schema(self, on_loaded=None):
+        """Загружает колонки и PK всех таблиц схемы public в кэш (два запроса на всю схему).
+        Выполняется в фоне, чтобы не задерживать открытие окна; пока загрузка идёт,
+        get_table_columns_and_pk дочитывает нужную таблицу сам. on_loaded(err) — в потоке Tk."""
+        def _apply(result):
+            schema, err = result
+            # при ошибке не критично: метаданные будут догружаться по таблице при обращении
+            if not err:
+                self._schema_cache.update(schema)
+            if on_loaded is not None:
+                on_loaded(err)
+
+        self.run_db(fetch_schema, _apply)
+
+    def refresh_schema(self):
+        """Перечитывает метаданные таблиц (например, после изменения структуры БД извне)."""
+        self._schema_cache.clear()
+        self.invalidate_caches()
+        self.status_label.config(text="Refreshing schema...")
+
+        def _done(err):
+            self.status_label.config(text=f"Schema refresh failed: {err}" if err else "Schema refreshed")
+            if self.current_table:
+                self._page_cursor_stack = [None]
+                self.page = 0
+                self.reload_page()
+
+        self.load_schema(_done)
 
     def get_pk_cols(self, table):
-        # Этот метод остается без изменений, он использует get_table_columns_and_pk
-        _, pk_col = self.get_table_columns_and_pk(table)
-        return [pk_col] if pk_col else []
+        # все колонки настоящего PRIMARY KEY (пустой список, если PK нет)
+        _, pk_cols = self.get_table_meta(table)
+        return list(pk_cols or ())
         
     def get_table_columns(self, table):
         # Этот метод остается без изменений
@@ -743,9 +1293,9 @@ class ParkingApp:
         return cols
         
     def get_pk_cols(self, table):
-        """Возвращает список PK колонок (для простоты - список из одного элемента)"""
-        _, pk_col = self.get_table_columns_and_pk(table)
-        return [pk_col] if pk_col else []
+        """Возвращает список колонок PRIMARY KEY в порядке ключа (пустой, если PK нет)"""
+        _, pk_cols = self.get_table_meta(table)
+        return list(pk_cols or ())
 
     def get_table_columns(self, table):
         # Старый метод теперь использует новый для обратной совместимости
@@ -763,6 +1313,16 @@ class ParkingApp:
         if not cols:
             messagebox.showerror("Error", "Не удалось получить колонки")
             return
+        if self._filter_dlg is not None:
+            dlg, cb, ent = self._filter_dlg
+            # таблица могла смениться — обновляем список колонок и сбрасываем ввод
+            cb.configure(values=cols)
+            cb.set("")
+            ent.delete(0, "end")
+            dlg.deiconify()
+            dlg.grab_set()
+            cb.focus_set()
+            return
         dlg = tk.Toplevel(self.root)
         dlg.title("Filter")
         dlg.transient(self.root)
@@ -774,44 +1334,36 @@ class ParkingApp:
         ent = tk.Entry(dlg)
         ent.grid(row=1, column=1, padx=6, pady=6)
         
-        def on_ok():
-            vals = {}
-            for c in cols:
-                if c in entries:
-                    input_val = entries[c].get().strip()
-                    # *** ИСПРАВЛЕНИЕ 1: Преобразуем пустую строку в None ***
-                    # Это предотвратит попытку Postgres преобразовать "" в integer.
-                    vals[c] = input_val if input_val else None 
-                elif c in skip_cols and c in data:
-                    vals[c] = data[c]
-                else:
-                    vals[c] = None
-
-            # *** ИСПРАВЛЕНИЕ 2: КРИТИЧЕСКАЯ ПРОВЕРКА PK ***
-            # Проверяем, что ID/PK заполнен, если он ручной (manual_pk_tables)
-            cols_all, pk_col = self.get_table_columns_and_pk(self.current_table)
-            
-            if pk_col and self.current_table in self.manual_pk_tables:
-                # Проверка, что значение не None и не пустая строка
-                if vals.get(pk_col) is None or str(vals.get(pk_col)).strip() == "":
-                    messagebox.showerror("Validation Error", f"Поле '{pk_col}' должно быть заполнено (это Первичный ключ, не SERIAL).")
-                    return # Остаемся в диалоге
-
-            result["ok"] = True
-            result["values"] = vals
-            dlg.destroy()
+        def hide():
+            # не уничтожаем: при следующем открытии диалог только показывается
+            dlg.grab_release()
+            dlg.withdraw()
 
+        def on_ok():
+            col = cb.get()
+            val = ent.get().strip()
+            if val and not col:
+                messagebox.showerror("Validation Error", "Выберите колонку для фильтра")
+                return # Остаемся в диалоге
+            # пустое значение снимает фильтр
+            self.filter_col = col if val else None
+            self.filter_val = val if val else None
+            self.page = 0
+            self._page_cursor_stack = [None]
+            hide()
+            self.reload_page()
 
         def on_cancel():
-            dlg.destroy()
+            hide()
         btnf = tk.Frame(dlg)
         btnf.grid(row=2, column=0, columnspan=2, pady=8)
         tk.Button(btnf, text="OK", command=on_ok).pack(side="left", padx=6)
         tk.Button(btnf, text="Cancel", command=on_cancel).pack(side="left", padx=6)
         dlg.bind("<Return>", lambda e: on_ok())
         dlg.bind("<Escape>", lambda e: on_cancel())
+        dlg.protocol("WM_DELETE_WINDOW", on_cancel)
+        self._filter_dlg = (dlg, cb, ent)
         cb.focus_set()
-        self.root.wait_window(dlg)
 
     # -------------------------
     # Save last result to TXT (unchanged)
@@ -821,17 +1373,42 @@ class ParkingApp:
             messagebox.showinfo("Info", "Нет результата для сохранения")
             return
         cols, rows = self.last_query_result
+        sql_src = self.last_query_sql
         file = filedialog.asksaveasfilename(defaultextension=".txt", filetypes=[("Text files","*.txt")])
         if not file:
             return
-        try:
-            with open(file, "w", encoding="utf-8") as f:
-                f.write("\t".join(cols) + "\n")
-                for r in rows:
-                    f.write("\t".join("" if v is None else str(v) for v in r) + "\n")
-            messagebox.showinfo("Saved", f"Saved to {file}")
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
+        if not self._start_task("Save"):
+            return
+
+        def _do_save():
+            # выполняется в рабочем потоке; возвращает (None, текст ошибки или None)
+            try:
+                if sql_src:
+                    # перевыполняем запрос через COPY — сервер сам отдаёт готовый CSV
+                    q, params = sql_src
+                    with open(file, "wb", buffering=EXPORT_BUFFER) as f:
+                        copy_query_to(f, q, params)
+                else:
+                    # csv.writer форматирует строки в C; None пишется как пустая строка
+                    with open(file, "w", encoding="utf-8", newline="", buffering=EXPORT_BUFFER) as f:
+                        w = csv.writer(f, delimiter="\t", lineterminator="\n")
+                        w.writerow(cols)
+                        w.writerows(rows)
+                return None, None
+            except Exception as e:
+                return None, str(e)
+
+        def _done(result):
+            _, err = result
+            self._finish_task("Save")
+            self.status_label.config(text="Ready")
+            if err:
+                messagebox.showerror("Error", err)
+            else:
+                messagebox.showinfo("Saved", f"Saved to {file}")
+
+        self.status_label.config(text="Saving…")
+        self.run_db(_do_save, _done)
 
     # -------------------------
     # Backup DB via pg_dump (unchanged)
@@ -840,61 +1417,150 @@ class ParkingApp:
         if self.role != "admin":
             messagebox.showwarning("Permission", "Бэкап доступен только администратору")
             return
-        out = filedialog.asksaveasfilename(defaultextension=".dump", filetypes=[("Custom dump","*.dump"),("SQL","*.sql")])
+        out = filedialog.asksaveasfilename(defaultextension=".dump", filetypes=[("Custom dump","*.dump"),("Directory dump (parallel)","*.dir"),("SQL","*.sql"),("SQL (gzip)","*.sql.gz")])
         if not out:
             return
+        if not self._start_task("Backup"):
+            return
         # Use PGPASSWORD env to avoid interactive prompt
         env = os.environ.copy()
         env["PGPASSWORD"] = DB_CONFIG.get("password","")
+        if out.endswith(".dir"):
+            # формат "каталог" позволяет выгружать таблицы параллельно (-j)
+            fmt = ["-F", "d", "-j", str(BACKUP_JOBS)]
+        elif out.endswith(".sql.gz"):
+            # текстовый дамп pg_dump сжимает сам (как через | gzip), несжатый файл на диск не пишется
+            fmt = ["-F", "p", "-Z", str(BACKUP_GZIP_LEVEL)]
+        elif out.endswith(".sql"):
+            fmt = ["-F", "p"]
+        else:
+            fmt = ["-F", "c"]
         cmd = [
             "pg_dump",
             "-h", DB_CONFIG.get("host","localhost"),
             "-p", str(DB_CONFIG.get("port",5432)),
             "-U", DB_CONFIG.get("user"),
-            "-F", "c",
+            *fmt,
             "-b",
             "-v",
             "-f", out,
             DB_CONFIG.get("dbname")
         ]
         try:
-            proc = subprocess.run(cmd, env=env, capture_output=True, text=True)
-            if proc.returncode == 0:
-                messagebox.showinfo("Backup", f"Backup saved to {out}")
-            else:
-                messagebox.showerror("Backup error", f"{proc.returncode}\n{proc.stdout}\n{proc.stderr}")
+            proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                    text=True, encoding="utf-8", errors="replace", bufsize=1)
         except FileNotFoundError:
+            self._finish_task("Backup")
             messagebox.showerror("Backup error", "pg_dump not found. Ensure PostgreSQL bin directory is in PATH.")
+            return
         except Exception as e:
+            self._finish_task("Backup")
             messagebox.showerror("Backup error", str(e))
+            return
+        # подробный лог (-v) читаем построчно в отдельном потоке, чтобы pipe не переполнился
+        # и не остановил pg_dump; в памяти держим только последние строки
+        tail = deque(maxlen=BACKUP_LOG_TAIL)
+        reader = threading.Thread(target=tail.extend, args=(proc.stderr,), daemon=True)
+        reader.start()
+        self.status_label.config(text="Backup in progress…")
+        self.root.after(BACKUP_POLL_MS, self._poll_backup, proc, reader, tail, out)
+
+    def _poll_backup(self, proc, reader, tail, out):
+        if proc.poll() is None:
+            if tail:
+                self.status_label.config(text="Backup: " + tail[-1].strip())
+            self.root.after(BACKUP_POLL_MS, self._poll_backup, proc, reader, tail, out)
+            return
+        reader.join(timeout=1)
+        proc.stderr.close()
+        self._finish_task("Backup")
+        self.status_label.config(text="Ready")
+        if proc.returncode == 0:
+            messagebox.showinfo("Backup", f"Backup saved to {out}")
+        else:
+            messagebox.showerror("Backup error", f"{proc.returncode}\n{''.join(tail)}")
 
     # -------------------------
     # Show cars on parking (special) (unchanged)
     # -------------------------
-    def cmd_show_cars_on_parking(self):
+    def cmd_show_cars_on_parking(self, page=0, page_size=CARS_PAGE_SIZE):
+        # без флага _running: новая загрузка заменяет предыдущую, а её устаревший
+        # результат отбрасывается по _load_seq
         self.current_table = None
-        q = """
-            SELECT car.c_number, car.mark, car.model, driver.name as driver_name, cop.parking_number
+        self._load_seq += 1  # отбрасываем незавершённую загрузку страницы таблицы
+        seq = self._load_seq
+        # FROM/JOIN отдельно: count(*) строится по нему, без ORDER BY и лишней сортировки
+        from_join = """
             FROM Car_on_parking cop
             JOIN Car car ON cop.car_number = car.c_number
             LEFT JOIN Driver driver ON car.driver_name = driver.name
-            ORDER BY cop.parking_number;
         """
-        res, err = fetch_all(q)
-        if err:
-            messagebox.showerror("Error", err)
-            return
-        cols, rows = res
-        self.last_query_result = (cols, rows)
-        self.build_tree(cols)
-        self.fill_tree(rows)
+        base = f"""
+            SELECT car.c_number, car.mark, car.model, driver.name as driver_name, cop.parking_number
+            {from_join}
+            ORDER BY cop.parking_number, car.c_number, driver.name
+        """
+        # выбираем с сервера только текущую страницу, а не весь join;
+        # OFFSET стабилен только при однозначном порядке: место не уникально, а LEFT JOIN
+        # может дать несколько водителей на машину — поэтому порядок доуточнён до строки
+        q = base + " LIMIT %s OFFSET %s;"
+        count_q = f"SELECT count(*) {from_join}"
+        # оба запроса повторяются при каждом листании — готовим их на сервере (PREPARE) один раз
+        page_stmt = ("cars", sql.SQL(base + " LIMIT $1 OFFSET $2"))
+        count_stmt = ("cars_count", sql.SQL(count_q))
+        # число строк кэшируется вместе с count(*) таблиц и сбрасывается при изменениях
+        count_key = ("cars_on_parking",)
+        cached_total = self._count_cache.get(count_key)
+
+        def _do_fetch():
+            total = cached_total
+            if total is None:
+                res, err = fetch_prepared(*count_stmt)
+                if err:
+                    return None, err
+                total = res[1][0][0] if res and res[1] else 0
+            pg = min(page, max(1, (total + page_size -1)//page_size) - 1)
+            params = (page_size, pg * page_size)
+            res, err = self.cached_fetch(q, params, prepared=page_stmt)
+            if err:
+                return None, err
+            return (total, pg, params, res), None
+
+        def _apply(result):
+            if seq != self._load_seq:
+                return  # пока грузили, пользователь открыл другую таблицу
+            data, err = result
+            if err:
+                self.status_label.config(text="Ошибка: " + err)
+                messagebox.showerror("Error", err)
+                return
+            total, pg, params, (cols, rows) = data
+            self._count_cache[count_key] = total
+            self._paging = {"page": pg, "size": page_size}
+            self.total_rows = total
+            self.page = pg
+            self.last_query_result = (cols, rows)
+            self.last_query_sql = (q, params)
+            self.build_tree(cols)
+            self.update_page_label()
+            self._feed_rows(rows, seq)
+
+        self.status_label.config(text="Loading…")
+        self.run_db(_do_fetch, _apply)
 
     # -------------------------
     # Quit (unchanged)
     # -------------------------
     def quit_app(self):
         if messagebox.askyesno("Exit", "Выход?"):
-            self.root.destroy()
+            self.close_app()
+
+    def close_app(self):
+        # закрытие крестиком — без подтверждения, как и раньше
+        self._stop.set()
+        self._db_executor.shutdown(wait=False)
+        close_pool()
+        self.root.destroy()
 
 # -------------------------
 # Run